@@ -1,110 +1,17 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
-from datetime import datetime
-import os
-import ast # To safely parse the secret string
+from datetime import datetime, date, timedelta
 
-# --- Firebase Imports ---
-import firebase_admin
-from firebase_admin import credentials, firestore
+# The Firebase SDK and the data layer are imported inside the authenticated
+# branch below, so login-page reruns don't pay their import cost.
 
 # --- Page Config (must be the first Streamlit command) ---
 st.set_page_config(layout="wide", page_title="NDMA Training Monitoring Dashboard")
 
-# --- Firebase Connection ---
-# FINAL, ROBUST VERSION: Handles secrets, project ID, and string parsing for deployment.
-@st.cache_resource
-def initialize_firebase():
-    if not firebase_admin._apps:
-        try:
-            # For deployed app on Streamlit Cloud
-            if "firebase_key" in st.secrets:
-                cred_info = st.secrets["firebase_key"]
-                cred_dict = {}
-
-                if isinstance(cred_info, str):
-                    cred_dict = ast.literal_eval(cred_info)
-                else:
-                    cred_dict = dict(cred_info)
-
-                cred = credentials.Certificate(cred_dict)
-                firebase_admin.initialize_app(cred, {
-                    'projectId': cred_dict['project_id'],
-                })
-            # For local development
-            else:
-                st.info("Initializing Firebase using local credentials...")
-                cred = credentials.ApplicationDefault()
-                firebase_admin.initialize_app(cred)
-            
-            return firestore.client()
-            
-        except Exception as e:
-            st.error(f"Failed to initialize Firebase: {e}", icon="🔥")
-            return None
-            
-    return firestore.client()
-
-# --- Data Fetching and Processing ---
-@st.cache_data(ttl=60)
-def get_firestore_data(_db):
-    if _db is None:
-        return pd.DataFrame(), pd.DataFrame()
-
-    training_sessions_data = []
-    agencies_data = []
-    try:
-        # Fetch Training Programs and their nested Sessions
-        programs_ref = _db.collection('training_programs')
-        for program_doc in programs_ref.stream():
-            program_data = program_doc.to_dict()
-            program_id = program_doc.id
-            sessions_ref = program_doc.reference.collection('sessions')
-            for session_doc in sessions_ref.stream():
-                session_data = session_doc.to_dict()
-                combined_record = {**program_data, **session_data, 'program_id': program_id, 'session_id': session_doc.id}
-                training_sessions_data.append(combined_record)
-        df_trainings = pd.DataFrame(training_sessions_data)
-
-        # Fetch Training Agencies
-        agencies_ref = _db.collection('training_agencies')
-        for doc in agencies_ref.stream():
-            record = doc.to_dict()
-            record['agency_id'] = doc.id
-            agencies_data.append(record)
-        df_agencies = pd.DataFrame(agencies_data)
-
-        # --- Data Cleaning ---
-        if not df_trainings.empty:
-            df_trainings = df_trainings.rename(columns={
-                'title': 'Program Title', 'location': 'State/District', 
-                'theme': 'Training Theme', 'date': 'Date of Session',
-                'attendees': 'Number of Attendees', 'notes': 'Remarks'
-            })
-            df_trainings['Date of Session'] = pd.to_datetime(df_trainings['Date of Session'], format='%d-%m-%Y', errors='coerce')
-            # Add coordinates for map feature
-            # In a real app, these would come from the database or a proper lookup
-            district_coords = {
-                'Thiruvananthapuram': {'lat': 8.5241, 'lon': 76.9366}, 'Kollam': {'lat': 8.8932, 'lon': 76.6141},
-                'Pathanamthitta': {'lat': 9.2647, 'lon': 76.7870}, 'Alappuzha': {'lat': 9.4981, 'lon': 76.3388},
-                'Kottayam': {'lat': 9.5916, 'lon': 76.5222}, 'Idukki': {'lat': 9.8530, 'lon': 76.9800},
-                'Ernakulam': {'lat': 9.9816, 'lon': 76.2999}, 'Thrissur': {'lat': 10.5276, 'lon': 76.2144},
-                'Palakkad': {'lat': 10.7867, 'lon': 76.6548}, 'Malappuram': {'lat': 11.0514, 'lon': 76.0711},
-                'Kozhikode': {'lat': 11.2588, 'lon': 75.7804}, 'Wayanad': {'lat': 11.6854, 'lon': 76.1320},
-                'Kannur': {'lat': 11.8745, 'lon': 75.3704}, 'Kasaragod': {'lat': 12.5089, 'lon': 74.9880}
-            }
-            df_trainings['lat'] = df_trainings['State/District'].map(lambda x: district_coords.get(x, {}).get('lat'))
-            df_trainings['lon'] = df_trainings['State/District'].map(lambda x: district_coords.get(x, {}).get('lon'))
-
-
-        if not df_agencies.empty:
-            df_agencies = df_agencies.rename(columns={'name': 'Agency Name', 'type': 'Agency Type'})
-
-        return df_trainings, df_agencies
-    except Exception as e:
-        st.error(f"Error fetching data from Firestore: {e}")
-        return pd.DataFrame(), pd.DataFrame()
+# Pre-sorted form options, built once at import instead of per rerun.
+STATES_AND_UTS = tuple(sorted(["Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh", "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand", "Karnataka", "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur", "Meghalaya", "Mizoram", "Nagaland", "Odisha", "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu", "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand", "West Bengal", "Andaman and Nicobar Islands", "Chandigarh", "Dadra and Nagar Haveli and Daman and Diu", "Delhi", "Jammu and Kashmir", "Ladakh", "Lakshadweep", "Puducherry"]))
+TRAINING_THEMES = ('Earthquake Preparedness', 'Flood Response', 'Cyclone Safety', 'First Aid', 'Community Evacuation', 'Search and Rescue', 'Fire Safety')
+AGENCY_TYPES = ('SDMA', 'ATI', 'NGO', 'CSO')
 
 # --- Authentication ---
 if 'authenticated' not in st.session_state:
@@ -126,61 +33,134 @@ if not st.session_state.authenticated:
             st.error("Invalid username or password.")
 else:
     # --- Main Dashboard ---
-    db = initialize_firebase()
+    # Deferred imports: only authenticated sessions load the Firebase stack,
+    # which data_access pulls in at module import. data_access is shared so
+    # any future page reuses the same cache entries (Streamlit keys caches
+    # by function object identity).
+    from firebase_admin import firestore
+    from data_access import (
+        initialize_firebase, get_trainings, get_agencies, get_counters,
+        get_unique_locations, filter_trainings, compute_location_counts,
+        clear_parquet_caches,
+    )
 
-    states_and_uts = ["Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh", "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand", "Karnataka", "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur", "Meghalaya", "Mizoram", "Nagaland", "Odisha", "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu", "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand", "West Bengal", "Andaman and Nicobar Islands", "Chandigarh", "Dadra and Nagar Haveli and Daman and Diu", "Delhi", "Jammu and Kashmir", "Ladakh", "Lakshadweep", "Puducherry"]
+    db = initialize_firebase()
 
     if db:
+        # Server-side recency window: Firestore only streams sessions recorded
+        # on/after this date instead of the full history.
+        st.sidebar.header("Data Window")
+        from_date = st.sidebar.date_input("Load sessions from", value=date.today() - timedelta(days=30))
+        since = datetime.combine(from_date, datetime.min.time())
+
         with st.spinner('Loading dashboard data...'):
-            df_trainings, df_agencies = get_firestore_data(db)
+            df_trainings = get_trainings(db, since)
+            df_agencies = get_agencies(db)
 
         # --- Sidebar ---
         st.sidebar.markdown("---")
+        if st.sidebar.button("Full refresh"):
+            st.session_state.pop('trainings_cache', None)
+            st.session_state.pop('trainings_last_ts', None)
+            # Also drop the Parquet snapshots, or the cold start would serve
+            # them right back while they're inside their freshness TTL.
+            clear_parquet_caches()
+            st.cache_data.clear()
+            st.rerun()
         if st.sidebar.button("Logout"):
             st.session_state.authenticated = False
             st.cache_data.clear(); st.cache_resource.clear()
             st.rerun()
-            
+
         st.sidebar.header("Filter Training Data")
         if not df_trainings.empty:
-            unique_locations = sorted(df_trainings['State/District'].dropna().unique())
+            unique_locations = get_unique_locations(df_trainings)
             selected_locations = st.sidebar.multiselect("Filter by Location", options=unique_locations, default=unique_locations)
-            
-            df_trainings_filtered = df_trainings[df_trainings['State/District'].isin(selected_locations)]
+
+            # tuple() so the selection is hashable as a cache key
+            df_trainings_filtered = filter_trainings(df_trainings, tuple(selected_locations))
         else:
             st.sidebar.info("No training data to filter.")
             df_trainings_filtered = pd.DataFrame()
 
+        # Per-location session counts, computed once per rerun and shared by
+        # every view that needs them (chart now, map/metrics as they grow).
+        if not df_trainings_filtered.empty:
+            location_counts = compute_location_counts(df_trainings_filtered)
+        else:
+            location_counts = pd.DataFrame(columns=['State/District', 'Number of Sessions'])
+
         # --- Main Page ---
         st.title("NDMA Training Monitoring Dashboard 📈")
-        
-        tab1, tab2, tab3 = st.tabs(["Trainings Overview", "Agencies Overview", "Add Records"])
 
-        with tab1:
+        # Each tab renders inside an st.fragment, so a widget interaction in
+        # one tab (table page, form inputs) reruns only that fragment instead
+        # of re-executing the other tabs' rendering.
+        @st.fragment
+        def render_trainings_tab(df_trainings_filtered, location_counts):
             st.header("Disaster Management Training Analytics")
             if not df_trainings_filtered.empty:
                 col1, col2, col3 = st.columns(3)
-                col1.metric("Total Programs", df_trainings_filtered['program_id'].nunique())
+                # One aggregation pass for both column reductions; len() is free.
+                stats = df_trainings_filtered.agg({'program_id': 'nunique', 'Number of Attendees': 'sum'})
+                col1.metric("Total Programs", int(stats['program_id']))
                 col2.metric("Total Sessions Conducted", len(df_trainings_filtered))
-                col3.metric("Total Attendees Trained", int(df_trainings_filtered['Number of Attendees'].sum()))
+                col3.metric("Total Attendees Trained", int(stats['Number of Attendees']))
+
+                # All-time totals come from the O(1) counters doc; the metric
+                # row above stays pandas-side because it honours the data
+                # window and location filter, which counters cannot.
+                counters = get_counters(db)
+                if counters:
+                    st.caption(
+                        f"All-time: {counters.get('sessions', 0)} sessions, "
+                        f"{counters.get('attendees', 0):,} attendees across "
+                        f"{len(counters.get('programs', {}))} programs"
+                    )
 
                 st.subheader("Geographic Spread of Training Sessions")
-                st.map(df_trainings_filtered[['lat', 'lon']].dropna())
+                # One point per district centroid (sized by session count)
+                # instead of one overlapping marker per session row.
+                map_points = (df_trainings_filtered[['lat', 'lon']].dropna()
+                              .groupby(['lat', 'lon'], as_index=False).size())
+                map_points['size'] = map_points['size'] * 2000  # metres; scales dot radius with count
+                st.map(map_points, latitude='lat', longitude='lon', size='size')
 
                 st.subheader("Training Sessions by State/District")
-                location_chart = alt.Chart(df_trainings_filtered).mark_bar().encode(
-                    x=alt.X('State/District:N', sort='-y', axis=alt.Axis(title='Location', labelAngle=-45)),
-                    y=alt.Y('count():Q', title='Number of Sessions'),
-                    tooltip=['State/District', 'count()']
-                ).interactive()
-                st.altair_chart(location_chart, use_container_width=True)
+                # Hand-written Vega-Lite spec over the tiny shared aggregate:
+                # skips Altair's schemapi validation/serialization layer and
+                # ships one row per location to the browser.
+                st.vega_lite_chart(location_counts, {
+                    "mark": "bar",
+                    "encoding": {
+                        "x": {"field": "State/District", "type": "nominal", "sort": "-y",
+                              "axis": {"title": "Location", "labelAngle": -45}},
+                        "y": {"field": "Number of Sessions", "type": "quantitative"},
+                        "tooltip": [{"field": "State/District"}, {"field": "Number of Sessions"}]
+                    }
+                }, use_container_width=True)
 
                 st.subheader("All Training Session Records (Filtered)")
-                st.dataframe(df_trainings_filtered, use_container_width=True)
+                # Render one page at a time so only a window of rows is
+                # serialized to the browser, not the whole history.
+                page_size = 100
+                total_pages = max((len(df_trainings_filtered) - 1) // page_size + 1, 1)
+                page = st.number_input("Page", min_value=1, max_value=total_pages, value=1)
+                start = (page - 1) * page_size
+                # Ship only the display columns — lat/lon and the recordedAt
+                # bookkeeping timestamp don't belong in the table payload.
+                display_cols = [c for c in ('program_id', 'Program Title', 'Training Theme',
+                                            'Date of Session', 'State/District',
+                                            'Number of Attendees', 'Remarks')
+                                if c in df_trainings_filtered.columns]
+                st.dataframe(df_trainings_filtered.iloc[start:start + page_size][display_cols],
+                             use_container_width=True, hide_index=True)
+                st.caption(f"Showing rows {start + 1}–{min(start + page_size, len(df_trainings_filtered))} of {len(df_trainings_filtered)}")
             else:
                 st.info("No training data to display for the selected filters.")
 
-        with tab2:
+        @st.fragment
+        def render_agencies_tab(df_agencies):
             st.header("Partner Agency Overview")
             if not df_agencies.empty:
                 st.metric("Total Training Agencies", len(df_agencies))
@@ -188,17 +168,18 @@ else:
             else:
                 st.info("No agency data to display. Add some in the 'Add Records' tab.")
 
-        with tab3:
+        @st.fragment
+        def render_add_records_tab():
             st.header("Log New Records")
-            
+
             st.subheader("➕ Log a New Training Session")
             with st.form(key='new_training_form', clear_on_submit=True):
                 program_id = st.text_input("Unique Program ID (e.g., KERALA-SDMA-001)")
                 program_title = st.text_input("Program Title (e.g., 'Community First Responder Training')")
                 session_date = st.text_input("Date of Session (dd-mm-yyyy)")
                 attendees = st.number_input("Number of Attendees", min_value=0, step=1)
-                location = st.selectbox("State/UT of Training", options=sorted(states_and_uts))
-                theme = st.selectbox("Training Theme", options=['Earthquake Preparedness', 'Flood Response', 'Cyclone Safety', 'First Aid', 'Community Evacuation', 'Search and Rescue', 'Fire Safety'])
+                location = st.selectbox("State/UT of Training", options=STATES_AND_UTS)
+                theme = st.selectbox("Training Theme", options=TRAINING_THEMES)
                 notes = st.text_area("Remarks / Notes")
                 submit_button = st.form_submit_button(label='Log Training Session')
 
@@ -207,40 +188,69 @@ else:
                         st.warning("Program ID, Title, and Date are required.")
                     else:
                         try:
-                            program_doc_ref = db.collection('training_programs').doc(program_id)
-                            program_doc = program_doc_ref.get()
-                            
+                            program_doc_ref = db.collection('training_programs').document(program_id)
+
+                            # Store a real timestamp; old rows hold dd-mm-yyyy
+                            # strings, which the read path still accepts.
                             session_data = {
-                                'date': session_date, 
-                                'attendees': attendees, 
+                                'date': datetime.strptime(session_date, '%d-%m-%Y'),
+                                'attendees': attendees,
                                 'location': location,
                                 'notes': notes,
+                                # Denormalized program fields so the dashboard
+                                # can read sessions without the parent lookup
+                                'title': program_title,
+                                'theme': theme,
                                 'recordedAt': firestore.SERVER_TIMESTAMP
                             }
-                            
-                            if not program_doc.exists:
-                                program_doc_ref.set({'title': program_title, 'theme': theme})
-                            
-                            program_doc_ref.collection('sessions').add(session_data)
+
+                            # One batched round trip instead of get + set + add;
+                            # merge=True upserts the program doc either way.
+                            batch = db.batch()
+                            batch.set(program_doc_ref, {'title': program_title, 'theme': theme}, merge=True)
+                            session_ref = program_doc_ref.collection('sessions').document()
+                            batch.set(session_ref, session_data)
+                            # Keep the all-time totals doc current so the KPI
+                            # row can read one doc instead of scanning rows.
+                            batch.set(db.collection('meta').document('counters'), {
+                                'sessions': firestore.Increment(1),
+                                'attendees': firestore.Increment(int(attendees)),
+                                'programs': {program_id: True},
+                            }, merge=True)
+                            batch.commit()
                             st.success(f"New session for program {program_id} logged successfully!")
-                            st.cache_data.clear()
+                            get_trainings.clear()
+                            get_counters.clear()
+                            # Fragment submits don't rerun the main body, so
+                            # the other tabs would keep the pre-write frames;
+                            # force a full-script rerun to reload them.
+                            st.rerun(scope="app")
                         except Exception as e:
                             st.error(f"Error adding record: {e}")
-            
+
             st.markdown("---")
-            
+
             st.subheader("➕ Add a New Training Agency")
             with st.form(key='new_agency_form', clear_on_submit=True):
                 agency_name = st.text_input("Agency Name (e.g., 'State Disaster Management Authority')")
-                agency_type = st.selectbox("Agency Type", options=["SDMA", "ATI", "NGO", "CSO"])
+                agency_type = st.selectbox("Agency Type", options=AGENCY_TYPES)
                 submit_agency_button = st.form_submit_button(label='Add Agency')
 
                 if submit_agency_button and agency_name:
                     try:
                         db.collection('training_agencies').add({'name': agency_name, 'type': agency_type})
                         st.success(f"Agency '{agency_name}' added successfully!")
-                        st.cache_data.clear()
+                        get_agencies.clear()
+                        st.rerun(scope="app")  # see the session form above
                     except Exception as e:
                         st.error(f"Error adding agency: {e}")
+
+        tab1, tab2, tab3 = st.tabs(["Trainings Overview", "Agencies Overview", "Add Records"])
+        with tab1:
+            render_trainings_tab(df_trainings_filtered, location_counts)
+        with tab2:
+            render_agencies_tab(df_agencies)
+        with tab3:
+            render_add_records_tab()
     else:
         st.error("Could not connect to Firebase. Please check your credentials and network connection.")
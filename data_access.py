@@ -0,0 +1,403 @@
+"""Shared Firestore access layer for the dashboard pages.
+
+Streamlit keys st.cache_resource/st.cache_data entries by function object
+identity, so every page that imports these accessors shares one client and
+one cached copy of each frame instead of re-fetching per file. Import this
+module only after authentication — it pulls in the Firebase SDK.
+"""
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+from datetime import datetime
+import os
+import time
+import fcntl
+import tempfile
+import threading
+import functools
+import json
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+# --- Firebase Connection ---
+# FINAL, ROBUST VERSION: Handles secrets, project ID, and string parsing for deployment.
+# Module-level singleton guarded by a lock so every session in this process
+# shares one gRPC channel and concurrent first requests can't race
+# initialize_app; st.cache_resource sits on top for Streamlit's bookkeeping.
+_DB_LOCK = threading.Lock()
+_DB = None
+
+# gzip the many small streamed documents and keep the channel alive between
+# the 60-second cache refreshes so each poll reuses the warm connection.
+GRPC_CHANNEL_OPTIONS = (
+    ('grpc.default_compression_algorithm', 2),  # CompressionAlgorithm.gzip
+    ('grpc.keepalive_time_ms', 30000),
+)
+
+def _make_firestore_client():
+    # Wire GRPC_CHANNEL_OPTIONS into the client's transport. The transport
+    # plumbing is not part of the SDK's public surface, so any failure falls
+    # back to the stock client rather than breaking the dashboard.
+    try:
+        import google.auth
+        from google.cloud import firestore as gc_firestore
+        from google.cloud.firestore_v1.services.firestore import client as gapic_client_mod
+        from google.cloud.firestore_v1.services.firestore.transports.grpc import FirestoreGrpcTransport
+
+        app = firebase_admin.get_app()
+        creds = app.credential.get_credential()
+        project = app.project_id or google.auth.default()[1]
+        client = gc_firestore.Client(project=project, credentials=creds)
+        channel = FirestoreGrpcTransport.create_channel(
+            credentials=creds, options=list(GRPC_CHANNEL_OPTIONS))
+        transport = FirestoreGrpcTransport(channel=channel)
+        client._firestore_api_internal = gapic_client_mod.FirestoreClient(transport=transport)
+        return client
+    except Exception:
+        return firestore.client()
+
+@functools.lru_cache(maxsize=1)
+def _parse_cred(raw):
+    # The service-account secret is hundreds of bytes of key material; parse
+    # it once per process instead of on every initialize_firebase call.
+    # Service-account keys are JSON, so use the C json parser rather than
+    # ast.literal_eval's full Python AST walk (which also mishandles
+    # true/false/null).
+    return json.loads(raw)
+
+@st.cache_resource
+def initialize_firebase():
+    global _DB
+    with _DB_LOCK:
+        if _DB is not None:
+            return _DB
+        if not firebase_admin._apps:
+            try:
+                # For deployed app on Streamlit Cloud
+                if "firebase_key" in st.secrets:
+                    cred_info = st.secrets["firebase_key"]
+                    cred_dict = {}
+
+                    if isinstance(cred_info, str):
+                        cred_dict = _parse_cred(cred_info)
+                    else:
+                        cred_dict = dict(cred_info)
+
+                    cred = credentials.Certificate(cred_dict)
+                    firebase_admin.initialize_app(cred, {
+                        'projectId': cred_dict['project_id'],
+                    })
+                # For local development
+                else:
+                    st.info("Initializing Firebase using local credentials...")
+                    cred = credentials.ApplicationDefault()
+                    firebase_admin.initialize_app(cred)
+
+            except Exception as e:
+                st.error(f"Failed to initialize Firebase: {e}", icon="🔥")
+                return None
+
+        _DB = _make_firestore_client()
+        return _DB
+
+# --- Data Fetching and Processing ---
+# On-disk cache so a fresh Streamlit worker (or a process restart) can reload
+# the last snapshot from Parquet instead of re-streaming all of Firestore.
+TRAININGS_PARQUET = os.path.join(tempfile.gettempdir(), 'trainings.parquet')
+AGENCIES_PARQUET = os.path.join(tempfile.gettempdir(), 'agencies.parquet')
+PARQUET_TTL_SECONDS = 60
+
+def _read_parquet_cache(path):
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < PARQUET_TTL_SECONDS:
+        try:
+            return pd.read_parquet(path)
+        except Exception:
+            return None  # Corrupt/partial file; fall through to Firestore
+    return None
+
+def _write_parquet_cache(df, path, since=None):
+    try:
+        # Lock so concurrent Streamlit workers don't interleave writes
+        with open(path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            df.to_parquet(path, compression='zstd')
+            # Sidecar recording the window the snapshot was fetched with, so
+            # readers can tell a fresh-but-narrower cache from one that
+            # actually covers their request.
+            with open(path + '.meta', 'w') as meta_file:
+                json.dump({'since': since.isoformat() if since is not None else None}, meta_file)
+    except Exception:
+        pass  # Cache write failures should never break the dashboard
+
+def clear_parquet_caches():
+    # Escape hatch for the "Full refresh" button: drop the on-disk snapshots
+    # (and their window sidecars) so the next cold start streams Firestore
+    # even while the files are inside their freshness TTL.
+    for path in (TRAININGS_PARQUET, AGENCIES_PARQUET):
+        for stale in (path, path + '.meta'):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+def _cache_covers(path, since):
+    # A snapshot satisfies a request only if it was fetched with a window
+    # starting at or before the requested one (None means full history).
+    try:
+        with open(path + '.meta') as meta_file:
+            covered = json.load(meta_file).get('since')
+    except Exception:
+        return False  # No/unreadable sidecar (pre-metadata cache)
+    if covered is None:
+        return True
+    if since is None:
+        return False
+    return datetime.fromisoformat(covered) <= since
+
+MAX_SESSION_DOCS = 5000
+
+# Fields streamed from session documents (also the select() projection).
+SESSION_FIELDS = ('date', 'attendees', 'location', 'notes', 'title', 'theme', 'recordedAt')
+
+# Display columns kept as category dtype (see _clean_trainings).
+CATEGORY_COLS = ('State/District', 'Training Theme', 'Program Title')
+
+# Coordinates for the map feature, built once at import.
+# In a real app, these would come from the database or a proper lookup
+DISTRICT_COORDS = {
+    'Thiruvananthapuram': {'lat': 8.5241, 'lon': 76.9366}, 'Kollam': {'lat': 8.8932, 'lon': 76.6141},
+    'Pathanamthitta': {'lat': 9.2647, 'lon': 76.7870}, 'Alappuzha': {'lat': 9.4981, 'lon': 76.3388},
+    'Kottayam': {'lat': 9.5916, 'lon': 76.5222}, 'Idukki': {'lat': 9.8530, 'lon': 76.9800},
+    'Ernakulam': {'lat': 9.9816, 'lon': 76.2999}, 'Thrissur': {'lat': 10.5276, 'lon': 76.2144},
+    'Palakkad': {'lat': 10.7867, 'lon': 76.6548}, 'Malappuram': {'lat': 11.0514, 'lon': 76.0711},
+    'Kozhikode': {'lat': 11.2588, 'lon': 75.7804}, 'Wayanad': {'lat': 11.6854, 'lon': 76.1320},
+    'Kannur': {'lat': 11.8745, 'lon': 75.3704}, 'Kasaragod': {'lat': 12.5089, 'lon': 74.9880}
+}
+def _coord_arrays(categories):
+    # Dense per-category coordinate arrays aligned to the category codes;
+    # unknown locations get NaN.
+    lat = np.array([DISTRICT_COORDS.get(c, {}).get('lat', np.nan) for c in categories], dtype=np.float64)
+    lon = np.array([DISTRICT_COORDS.get(c, {}).get('lon', np.nan) for c in categories], dtype=np.float64)
+    return lat, lon
+
+def _stream_sessions(_db, after_ts=None, since=None):
+    # Fetch Sessions with one collection-group query instead of one
+    # subcollection stream per program (the old N+1 pattern). The parent
+    # program id is recovered from each session's document path. With
+    # after_ts, only sessions recorded after that timestamp are pulled;
+    # with since, the server filters to the requested recency window.
+    # Project only the fields the dashboard renders so long notes or any
+    # future additions don't ride along on every streamed document.
+    sessions_query = _db.collection_group('sessions').select(list(SESSION_FIELDS))
+    if after_ts is not None:
+        sessions_query = sessions_query.where(filter=FieldFilter('recordedAt', '>', after_ts)).order_by('recordedAt')
+    elif since is not None:
+        sessions_query = (sessions_query
+                          .where(filter=FieldFilter('recordedAt', '>=', since))
+                          .order_by('recordedAt', direction='DESCENDING')
+                          .limit(MAX_SESSION_DOCS))
+    sessions = list(sessions_query.stream())
+    if not sessions:
+        return pd.DataFrame()
+
+    # Column-major (SoA) construction: append each field to its own list and
+    # build every column in one shot, instead of allocating a merged dict per
+    # row and letting pandas re-infer the schema row by row. The Arrow-backed
+    # frame also skips a re-serialization when st.dataframe ships it over
+    # Arrow transport later.
+    cols = {field: [] for field in SESSION_FIELDS + ('program_id', 'session_id')}
+    for session_doc in sessions:
+        data = session_doc.to_dict()
+        for field in SESSION_FIELDS:
+            value = data.get(field)
+            # 'date' is a native timestamp on new docs but a dd-mm-yyyy
+            # string on legacy ones, and pa.table refuses a mixed column;
+            # render timestamps in the legacy format (dropping the tz the
+            # Firestore SDK attaches) so the column stays homogeneous and
+            # _clean_trainings can parse it with one explicit format.
+            if field == 'date' and isinstance(value, datetime):
+                value = value.strftime('%d-%m-%Y')
+            cols[field].append(value)
+        cols['program_id'].append(session_doc.reference.parent.parent.id)
+        cols['session_id'].append(session_doc.id)
+    df_sessions = pa.table(cols).to_pandas(types_mapper=pd.ArrowDtype)
+
+    # Sessions written since the denormalization change carry title/theme
+    # themselves; only legacy rows still need the parent program documents.
+    needs_parent = df_sessions['title'].isna() | df_sessions['theme'].isna()
+    program_ids = set(df_sessions.loc[needs_parent, 'program_id'])
+    program_refs = [_db.collection('training_programs').document(pid) for pid in program_ids]
+    programs_map = {doc.id: doc.to_dict() for doc in _db.get_all(program_refs, field_paths=['title', 'theme']) if doc.exists} if program_refs else {}
+    if programs_map:
+        df_programs = pd.DataFrame.from_dict(programs_map, orient='index').rename_axis('program_id').reset_index()
+        df_sessions = df_sessions.merge(df_programs, on='program_id', how='left', suffixes=('', '_program'))
+        # Newer session docs carry denormalized program fields; prefer those
+        # and fall back to the parent document for legacy rows.
+        for col in df_programs.columns:
+            parent_col = col + '_program'
+            if parent_col in df_sessions.columns:
+                # astype(object) first: an all-null Arrow column can't be
+                # filled with strings directly.
+                df_sessions[col] = df_sessions[col].astype('object').fillna(df_sessions[parent_col])
+                df_sessions = df_sessions.drop(columns=[parent_col])
+    return df_sessions
+
+# Trainings and agencies are cached separately so a write to one collection
+# only invalidates (and refetches) that collection via get_trainings.clear()
+# or get_agencies.clear(), instead of st.cache_data.clear() wiping both.
+@st.cache_data(ttl=60, max_entries=1, show_spinner=False, persist='disk')
+def get_trainings(_db, since=None):
+    if _db is None:
+        return pd.DataFrame()
+
+    try:
+        # Widening (or shifting) the data window invalidates the
+        # session-level snapshot; the watermark only tracks forward growth.
+        if st.session_state.get('trainings_since') != since:
+            st.session_state.pop('trainings_cache', None)
+            st.session_state.pop('trainings_last_ts', None)
+            st.session_state['trainings_since'] = since
+
+        # Incremental refresh: once this session holds a snapshot, only pull
+        # sessions recorded after the newest timestamp already seen instead of
+        # re-streaming the whole collection on every TTL expiry.
+        df_trainings = st.session_state.get('trainings_cache')
+        last_ts = st.session_state.get('trainings_last_ts')
+        if df_trainings is not None and last_ts is not None:
+            df_new = _clean_trainings(_stream_sessions(_db, after_ts=last_ts))
+            if not df_new.empty:
+                df_trainings = pd.concat([df_trainings, df_new], ignore_index=True)
+                # concat demotes categoricals whose category sets differ
+                # (new rows usually introduce values); restore the dtype.
+                for col in CATEGORY_COLS:
+                    if col in df_trainings.columns:
+                        df_trainings[col] = df_trainings[col].astype('category')
+        else:
+            # Cold start: serve from the Parquet cache when it is fresh AND
+            # was fetched with a window covering this request, otherwise
+            # stream the requested window from Firestore and rewrite the cache.
+            df_trainings = None
+            if _cache_covers(TRAININGS_PARQUET, since):
+                df_trainings = _read_parquet_cache(TRAININGS_PARQUET)
+            if df_trainings is not None and since is not None and 'recordedAt' in df_trainings.columns:
+                # Trim a wider snapshot down to the requested window.
+                df_trainings = df_trainings[df_trainings['recordedAt'] >= pd.Timestamp(since, tz='UTC')]
+            if df_trainings is None:
+                df_trainings = _clean_trainings(_stream_sessions(_db, since=since))
+                if not df_trainings.empty:
+                    _write_parquet_cache(df_trainings, TRAININGS_PARQUET, since=since)
+
+        st.session_state['trainings_cache'] = df_trainings
+        if not df_trainings.empty and 'recordedAt' in df_trainings.columns:
+            st.session_state['trainings_last_ts'] = df_trainings['recordedAt'].max()
+
+        return df_trainings
+    except Exception as e:
+        st.error(f"Error fetching training data from Firestore: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=300, max_entries=1, show_spinner=False, persist='disk')
+def get_agencies(_db):
+    if _db is None:
+        return pd.DataFrame()
+
+    try:
+        # Same two-tier cache as the trainings frame: a fresh worker reloads
+        # the last agency snapshot from disk instead of streaming Firestore.
+        df_cached = _read_parquet_cache(AGENCIES_PARQUET)
+        if df_cached is not None:
+            return df_cached
+
+        # Fetch Training Agencies straight into column lists (and under their
+        # display names, so the rename pass disappears too).
+        ids, names, types = [], [], []
+        for doc in _db.collection('training_agencies').select(['name', 'type']).stream():
+            record = doc.to_dict()
+            ids.append(doc.id)
+            names.append(record.get('name'))
+            types.append(record.get('type'))
+        df_agencies = pd.DataFrame({'agency_id': ids, 'Agency Name': names, 'Agency Type': types})
+
+        if not df_agencies.empty:
+            # Agency Type only ever holds SDMA/ATI/NGO/CSO; integer category
+            # codes beat per-row Python strings, as for the trainings columns.
+            df_agencies['Agency Type'] = df_agencies['Agency Type'].astype('category')
+            _write_parquet_cache(df_agencies, AGENCIES_PARQUET)
+        return df_agencies
+    except Exception as e:
+        st.error(f"Error fetching agency data from Firestore: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_counters(_db):
+    """Read the pre-aggregated totals doc maintained by the submit batch.
+
+    One document read instead of scanning sessions; returns {} when the
+    doc does not exist yet (fresh database or pre-counter data).
+    """
+    if _db is None:
+        return {}
+    try:
+        snapshot = _db.collection('meta').document('counters').get()
+        return snapshot.to_dict() or {}
+    except Exception:
+        return {}
+
+# The sidebar filter and its aggregate rerun on every widget interaction;
+# memoizing them on (frame, selection) means repeat filter states cost a
+# cache lookup instead of an isin scan plus a groupby.
+@st.cache_data(ttl=60, show_spinner=False)
+def get_unique_locations(df_trainings):
+    return sorted(df_trainings['State/District'].dropna().unique().tolist())
+
+@st.cache_data(ttl=60, show_spinner=False)
+def filter_trainings(df_trainings, locations):
+    return df_trainings[df_trainings['State/District'].isin(locations)]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def compute_location_counts(df_trainings_filtered):
+    # value_counts is a single hashed pass; groupby().size() goes through the
+    # grouper/index machinery for the same one-column tally.
+    counts = df_trainings_filtered['State/District'].value_counts()
+    counts = counts[counts > 0]  # categorical value_counts also lists unobserved categories
+    return counts.rename_axis('State/District').reset_index(name='Number of Sessions')
+
+def _clean_trainings(df_trainings):
+    # --- Data Cleaning ---
+    if not df_trainings.empty:
+        df_trainings = df_trainings.rename(columns={
+            'title': 'Program Title', 'location': 'State/District',
+            'theme': 'Training Theme', 'date': 'Date of Session',
+            'attendees': 'Number of Attendees', 'notes': 'Remarks'
+        })
+        # cache=True parses each distinct date string once; many sessions
+        # share the same date, so this is O(unique dates) not O(rows).
+        # _stream_sessions normalizes every value to this format.
+        df_trainings['Date of Session'] = pd.to_datetime(
+            df_trainings['Date of Session'], format='%d-%m-%Y',
+            errors='coerce', cache=True)
+        # These columns repeat a handful of values across every row; category
+        # dtype stores integer codes instead of one Python string per row,
+        # which also speeds up the groupby/isin/nunique done downstream.
+        for col in CATEGORY_COLS:
+            if col in df_trainings.columns:
+                df_trainings[col] = df_trainings[col].astype('category')
+
+        # Add coordinates for map feature: index small per-category arrays by
+        # the category codes — one vectorized gather per axis, no hashing.
+        categories = df_trainings['State/District'].cat.categories
+        if len(categories):
+            lat_arr, lon_arr = _coord_arrays(categories)
+            codes = df_trainings['State/District'].cat.codes.to_numpy()
+            valid = codes >= 0
+            df_trainings['lat'] = np.where(valid, lat_arr.take(codes.clip(0)), np.nan)
+            df_trainings['lon'] = np.where(valid, lon_arr.take(codes.clip(0)), np.nan)
+        else:
+            df_trainings['lat'] = np.nan
+            df_trainings['lon'] = np.nan
+
+    return df_trainings